@@ -1,6 +1,31 @@
+import os
+
 import pandas as pd
 import numpy as np
 
+MONTHS = [
+    "January",
+    "February",
+    "March",
+    "April",
+    "May",
+    "June",
+    "July",
+    "August",
+    "September",
+    "October",
+    "November",
+    "December",
+]
+
+# Southern Hemisphere availability is Northern shifted by six months,
+# so each hemisphere is just a rotation of the same 12-bit month mask
+HEMISPHERES = ["Northern", "Southern"]
+HEMISPHERE_OFFSETS = {"Northern": 0, "Southern": 6}
+
+# Column holding each creature's 12-bit month mask, bit i set if found in MONTHS[i]
+MONTH_MASK_COL = "Month mask"
+
 
 def filter_backend_table(backend_df):
     """Removes the 'metadata' within the backend table (such as T/F values for months)
@@ -76,9 +101,38 @@ def get_fish_logic(backend_df, selected_fish):
             return [False] * len(backend_df)
 
 
-def get_month_logic(backend_df, selected_months):
+def get_month_masks(backend_df):
+    """Returns the precomputed 12-bit month masks (Northern Hemisphere) as a
+    pd.Series, or builds them from the "January":"December" columns if missing"""
+
+    if MONTH_MASK_COL in backend_df.columns:
+        return backend_df[MONTH_MASK_COL]
+
+    month_bits = np.left_shift(1, np.arange(len(MONTHS)))
+    masks = backend_df[MONTHS].to_numpy(dtype=bool) @ month_bits
+    return pd.Series(masks.astype(np.uint16), index=backend_df.index)
+
+
+def add_month_masks(backend_df):
+    """Adds the MONTH_MASK_COL column to backend_df in place"""
+
+    backend_df[MONTH_MASK_COL] = get_month_masks(backend_df)
+    return backend_df
+
+
+def get_month_bit(month, hemisphere="Northern"):
+    """Returns the bit to test in a Northern month mask for month in hemisphere.
+
+    Rather than rotating every creature's mask, the single query bit is rotated,
+    so switching hemisphere costs O(1) and needs no second copy of the data.
+    """
+
+    return 1 << ((MONTHS.index(month) + HEMISPHERE_OFFSETS[hemisphere]) % 12)
+
+
+def get_month_logic(backend_df, selected_months, hemisphere="Northern"):
     """backend_df contains columns "January":"December" 
-    that are pre-determined boolean vectors"""
+    that are pre-determined boolean vectors (for the Northern Hemisphere)"""
 
     # if [] or None, return all false
     if not selected_months:
@@ -86,22 +140,25 @@ def get_month_logic(backend_df, selected_months):
 
     else:
 
-        # if str, return fish available in that single month
+        # if str, treat as a list of one month
         if isinstance(selected_months, str):
-            selected = backend_df[selected_months]  # type pd.Series, logical vector
-            return selected.tolist()
+            selected_months = [selected_months]
 
         # if list, return an intersection of all months
-        elif isinstance(selected_months, list):
+        if isinstance(selected_months, list):
 
-            # Begin with an all-true pd.Series object
-            selected = [True] * len(backend_df)
-
-            # Recursively multiply it by each month's logical vectors
+            # "All" (or any other non-month column) doesn't depend on hemisphere
+            selected = pd.Series(True, index=backend_df.index)
+            query_bits = 0
             for each_month in selected_months:
-                selected = (
-                    selected & backend_df[each_month]
-                )  # type pd.Series, logical vector
+                if each_month in MONTHS:
+                    query_bits |= get_month_bit(each_month, hemisphere)
+                else:
+                    selected = selected & backend_df[each_month]
+
+            # a creature is in every month if all the query bits are set in its mask
+            masks = get_month_masks(backend_df)
+            selected = selected & ((masks & query_bits) == query_bits)
 
             return selected.tolist()
 
@@ -111,7 +168,9 @@ def get_month_logic(backend_df, selected_months):
             return [False] * len(backend_df)
 
 
-def get_species_arriving_logic(selected_month, AVAIL_MONTHS, BACKEND_DF):
+def get_species_arriving_logic(
+    selected_month, AVAIL_MONTHS, BACKEND_DF, hemisphere="Northern"
+):
     """"can be used for bugs & fish I think"""
 
     # Explaination
@@ -122,17 +181,20 @@ def get_species_arriving_logic(selected_month, AVAIL_MONTHS, BACKEND_DF):
     # find index of selected month
     cur_month = AVAIL_MONTHS.index(selected_month)
 
-    # wrap around if December
+    # wrap around if January
     prev_month = cur_month - 1
 
-    cur_vector = BACKEND_DF[AVAIL_MONTHS[cur_month]]
-    prev_vector = BACKEND_DF[AVAIL_MONTHS[prev_month]]
+    masks = get_month_masks(BACKEND_DF)
+    cur_vector = (masks & get_month_bit(AVAIL_MONTHS[cur_month], hemisphere)) != 0
+    prev_vector = (masks & get_month_bit(AVAIL_MONTHS[prev_month], hemisphere)) != 0
 
-    # creatures NOT in this month but DEFINITELY next month
+    # creatures in this month but NOT last month
     return cur_vector & ~prev_vector
 
 
-def get_species_leaving_logic(selected_month, AVAIL_MONTHS, BACKEND_DF):
+def get_species_leaving_logic(
+    selected_month, AVAIL_MONTHS, BACKEND_DF, hemisphere="Northern"
+):
     """"can be used for bugs & fish I think"""
     # find index of selected month
     cur_month = AVAIL_MONTHS.index(selected_month)
@@ -143,31 +205,43 @@ def get_species_leaving_logic(selected_month, AVAIL_MONTHS, BACKEND_DF):
     else:
         next_month = cur_month + 1
 
-    cur_vector = BACKEND_DF[AVAIL_MONTHS[cur_month]]
-    next_vector = BACKEND_DF[AVAIL_MONTHS[next_month]]
+    masks = get_month_masks(BACKEND_DF)
+    cur_vector = (masks & get_month_bit(AVAIL_MONTHS[cur_month], hemisphere)) != 0
+    next_vector = (masks & get_month_bit(AVAIL_MONTHS[next_month], hemisphere)) != 0
 
-    # creatures NOT in this month but DEFINITELY next month
+    # creatures in this month but NOT next month
     return cur_vector & ~next_vector
 
 
 # to read in from a public Google Sheet
+# or from a local copy of it if ACNH_FISH_CSV is set (e.g. for offline load tests)
 def get_backend_fish_df():
+    if os.environ.get("ACNH_FISH_CSV"):
+        return get_local_backend_fish_df(os.environ["ACNH_FISH_CSV"])
     return download_creature_data("fish")
 
 
-# def get_local_backend_fish_df():
-# remember this?
+def get_local_backend_fish_df(path):
+    """path is a csv saved from get_creature_data_url("fish")"""
+    return clean_creature_data(pd.read_csv(path))
 
 
-def download_creature_data(creature_type):
+def get_creature_data_url(creature_type):
     """creature_type is the worksheet name in the Google Sheet, either fish or bugs"""
     google_sheet_id = "1YXGasmPBqnTw1B5gIfWA-ci7NiO-EdtS-PsxjNrYUls"
     #     worksheet_name = creature_type
-    URL = "https://docs.google.com/spreadsheets/d/{0}/gviz/tq?tqx=out:csv&sheet={1}".format(
+    return "https://docs.google.com/spreadsheets/d/{0}/gviz/tq?tqx=out:csv&sheet={1}".format(
         google_sheet_id, creature_type
     )
 
-    df = pd.read_csv(URL)
+
+def download_creature_data(creature_type):
+    """creature_type is the worksheet name in the Google Sheet, either fish or bugs"""
+    return clean_creature_data(pd.read_csv(get_creature_data_url(creature_type)))
+
+
+def clean_creature_data(df):
+    """Drops the sheet's empty columns and adds the month masks"""
     df = df.drop(
         columns=[
             "Unnamed: 0",
@@ -177,4 +251,4 @@ def download_creature_data(creature_type):
             "Unnamed: 25",
         ]
     )
-    return df
+    return add_month_masks(df)
@@ -0,0 +1,9 @@
+import os
+
+import serving
+from dashtable_app import server
+
+# e.g. gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+application = serving.make_asgi_app(
+    server, workers=int(os.environ.get("ACNH_ASGI_THREADS", 8))
+)
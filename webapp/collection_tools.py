@@ -0,0 +1,366 @@
+import atexit
+import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+# A user's collection is a dict that fits in a dcc.Store:
+#   {
+#       "user": str,
+#       "key": str,        # identifies the ordered creature names the bits are over
+#       "caught": hex str,
+#       "donated": hex str,
+#       "extra": {"caught": [str], "donated": [str]},
+#   }
+#
+# "caught" and "donated" are fixed-width bitsets: bit i is the creature in row i
+# of the backend dataframe, in byte i // 8 (little bit order), so 80 fish fit in
+# 20 hex chars. The names themselves stay on the server, in a small registry of
+# recent name lists keyed by "key". When the Google Sheet reorders, adds or
+# removes rows, a collection with a known older key is remapped by name.
+# Marked creatures that aren't in the current sheet are kept in "extra" so they
+# come back if the sheet does.
+
+COLLECTION_KINDS = ["caught", "donated"]
+
+# How many recent name lists to remember for remapping
+MAX_KNOWN_NAMES = 16
+
+_known_names = OrderedDict()  # key -> list of creature names, least recent first
+_known_names_lock = threading.Lock()
+
+
+def get_names_key(creature_names):
+    """Returns a short hash identifying an ordered list of creature names"""
+
+    return hashlib.sha1("\n".join(creature_names).encode()).hexdigest()[:16]
+
+
+def register_names(creature_names):
+    """Remembers creature_names for remapping and returns their key"""
+
+    key = get_names_key(creature_names)
+
+    with _known_names_lock:
+        if key not in _known_names:
+            _known_names[key] = list(creature_names)
+        _known_names.move_to_end(key)
+        if len(_known_names) > MAX_KNOWN_NAMES:
+            _known_names.popitem(last=False)
+
+    return key
+
+
+def get_known_names(key):
+    """Returns the creature names registered for key, or None if unknown"""
+
+    with _known_names_lock:
+        return _known_names.get(key)
+
+
+def is_known_collection(collection):
+    """True if collection's key is in the registry, so it can be remapped"""
+
+    return isinstance(collection, dict) and (
+        isinstance(collection.get("key"), str)
+        and get_known_names(collection["key"]) is not None
+    )
+
+
+def empty_bitset(n_creatures):
+    """Returns an all-false bitset wide enough for n_creatures, as a hex str"""
+
+    return "00" * ((n_creatures + 7) // 8)
+
+
+def bitset_to_logic(bitset, n_creatures):
+    """Unpacks a hex bitset into a numpy logical vector of length n_creatures
+
+    Raises:
+        ValueError: if bitset isn't hex of exactly the right width
+    """
+
+    if not isinstance(bitset, str) or len(bitset) != len(empty_bitset(n_creatures)):
+        raise ValueError("bitset is not {} creatures wide".format(n_creatures))
+
+    packed = np.frombuffer(bytes.fromhex(bitset), dtype=np.uint8)
+    return np.unpackbits(packed, count=n_creatures, bitorder="little").astype(bool)
+
+
+def logic_to_bitset(logic):
+    """Packs a logical vector (list, pd.Series or np.array) into a hex bitset"""
+
+    return np.packbits(np.asarray(logic, dtype=bool), bitorder="little").tobytes().hex()
+
+
+def new_collection(creature_names, user=None):
+    """Returns an empty collection over creature_names
+
+    Args:
+        creature_names (list): creature names in backend dataframe row order
+        user (str, optional): user id. A random one is made if not given.
+
+    Returns:
+        dict: collection that can be put straight into a dcc.Store
+    """
+
+    return {
+        "user": user or uuid.uuid4().hex,
+        "key": register_names(creature_names),
+        "caught": empty_bitset(len(creature_names)),
+        "donated": empty_bitset(len(creature_names)),
+        "extra": {kind: [] for kind in COLLECTION_KINDS},
+    }
+
+
+def get_marked_names(collection, kind, creature_names):
+    """Returns the set of creature names marked as kind, including "extra" ones.
+    creature_names are the names collection's bits are over."""
+
+    logic = bitset_to_logic(collection[kind], len(creature_names))
+    marked = set(np.asarray(creature_names, dtype=object)[logic])
+    return marked | set(collection["extra"][kind])
+
+
+def collection_from_names(marked, creature_names, user=None):
+    """Builds a collection over creature_names from {kind: set of marked names}"""
+
+    collection = new_collection(creature_names, user=user)
+    names = np.asarray(creature_names, dtype=object)
+
+    for kind in COLLECTION_KINDS:
+        collection[kind] = logic_to_bitset(np.isin(names, list(marked[kind])))
+        collection["extra"][kind] = sorted(marked[kind] - set(creature_names))
+
+    return collection
+
+
+def validate_collection(collection, creature_names):
+    """Checks a collection from the (client controlled) store against the dataset
+
+    Args:
+        collection (dict): see new_collection
+        creature_names (list): creature names in backend dataframe row order
+
+    Returns:
+        dict or None: collection, remapped by name if the sheet's rows changed,
+        or None if collection is empty, malformed or has a key this process
+        doesn't know (so it can't be remapped)
+    """
+
+    if not collection:
+        return None
+
+    key = register_names(creature_names)
+
+    try:
+        old_names = get_known_names(collection["key"])
+        if old_names is None:
+            print("there was an unknown collection key in validate_collection")
+            return None
+
+        # check every bitset decodes at its key's width, raising if not
+        marked = {
+            each: get_marked_names(collection, each, old_names)
+            for each in COLLECTION_KINDS
+        }
+
+        if collection["key"] == key:
+            return collection
+
+        return collection_from_names(marked, creature_names, user=collection["user"])
+
+    except (KeyError, TypeError, ValueError) as e:
+        print("there was an invalid collection in validate_collection: {}".format(e))
+        return None
+
+
+def update_collection(collection, kind, creature_names, value=True):
+    """Sets (or clears) the bits of creature_names of one kind in a collection
+
+    Args:
+        collection (dict): see new_collection, validated against the current data
+        kind (str): "caught" or "donated"
+        creature_names (list)
+        value (bool, optional): True to mark, False to unmark. Defaults to True.
+
+    Returns:
+        dict: a new collection, the original is left untouched
+    """
+
+    names = np.asarray(get_known_names(collection["key"]), dtype=object)
+    logic = bitset_to_logic(collection[kind], len(names))
+    logic[np.isin(names, creature_names)] = value
+
+    updated = dict(collection)
+    updated[kind] = logic_to_bitset(logic)
+    updated["extra"] = dict(collection["extra"])
+    if not value:
+        updated["extra"][kind] = sorted(
+            set(collection["extra"][kind]) - set(creature_names)
+        )
+    return updated
+
+
+def get_collection_logic(collection, kind):
+    """Returns the logical vector for one kind ("caught" or "donated")
+    of a collection validated against the current data"""
+
+    return bitset_to_logic(collection[kind], len(get_known_names(collection["key"])))
+
+
+def get_missing_logic(selected, collection, kind="caught"):
+    """Intersects a logical vector (e.g. from get_month_logic) with ~caught
+
+    Args:
+        selected (list, pd.Series or np.array): logical vector over creatures
+        collection (dict): see new_collection, validated against the same data
+        kind (str, optional): which bitset counts as "have it". Defaults to "caught".
+
+    Returns:
+        np.array: logical vector of selected creatures that are still missing
+    """
+
+    return np.logical_and(selected, ~get_collection_logic(collection, kind))
+
+
+class CollectionDB:
+    """Optional server-side persistence of collections in SQLite.
+
+    Every mark/unmark is appended as a row to an event log and never updated in
+    place. Events are keyed by creature name, not bit position, so they survive
+    the sheet being reordered. They are buffered in memory and written in a
+    single transaction by a background thread every flush_interval seconds, or
+    sooner once batch_size events are waiting, and once more at exit.
+    """
+
+    def __init__(self, path, batch_size=500, flush_interval=5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._pending = []
+        self._lock = threading.Lock()  # guards _pending only
+        self._db_lock = threading.Lock()  # guards _conn
+        self._flush_event = threading.Event()
+        self._closed = False
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS collection_events (
+                    user TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    creature TEXT NOT NULL,
+                    value INTEGER NOT NULL,
+                    ts REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS collection_events_user"
+                " ON collection_events (user)"
+            )
+
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name="collection-flush", daemon=True
+        )
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print("there was an error flushing collection events: {}".format(e))
+
+    def record(self, user, kind, creature_names, value=True):
+        """Queues one event per creature, waking the flusher if the batch is full"""
+
+        now = time.time()
+        rows = [(user, kind, str(each), int(value), now) for each in creature_names]
+
+        with self._lock:
+            # checked under the lock, so close() can't miss rows queued here
+            if self._closed:
+                print("there was a record() after CollectionDB.close(), not saved")
+                return
+            self._pending.extend(rows)
+            full = len(self._pending) >= self.batch_size
+
+        if full:
+            self._flush_event.set()
+
+    def flush(self):
+        """Writes every queued event in one transaction.
+
+        The buffer is swapped out under the lock and written outside it, so
+        record() never waits on disk. Rows are requeued if the write fails.
+        """
+
+        with self._lock:
+            rows, self._pending = self._pending, []
+
+        if not rows:
+            return
+
+        try:
+            with self._db_lock, self._conn:
+                self._conn.executemany(
+                    "INSERT INTO collection_events VALUES (?, ?, ?, ?, ?)", rows
+                )
+        except sqlite3.Error:
+            with self._lock:
+                self._pending[:0] = rows
+            raise
+
+    def load(self, user, creature_names):
+        """Replays a user's events into a collection over creature_names
+
+        Returns:
+            dict: the user's collection, empty if the user has no events
+        """
+
+        self.flush()
+
+        with self._db_lock:
+            events = self._conn.execute(
+                "SELECT kind, creature, value FROM collection_events"
+                " WHERE user = ? ORDER BY rowid",
+                (user,),
+            ).fetchall()
+
+        marked = {kind: set() for kind in COLLECTION_KINDS}
+        for kind, creature, value in events:
+            if kind in marked:
+                if value:
+                    marked[kind].add(creature)
+                else:
+                    marked[kind].discard(creature)
+
+        return collection_from_names(marked, creature_names, user=user)
+
+    def close(self):
+        """Stops the flusher, writes anything still queued and closes the db"""
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._flush_event.set()
+        self._flusher.join()
+
+        try:
+            self.flush()
+        finally:
+            with self._db_lock:
+                self._conn.close()
@@ -1,15 +1,19 @@
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import dash_table
 from dash.exceptions import PreventUpdate
 
+import os
+
 import pandas as pd
 import numpy as np
 
 import personal_dash_tools as tls
 import ac_df_tools as ac_tls
+import collection_tools as col_tls
+import serving
 
 #
 # REMINDERS
@@ -29,186 +33,300 @@ external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
 
 # Initialize app with external stylesheet
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+server = app.server  # for gunicorn, e.g. gunicorn dashtable_app:server
 
 #
 # CONSTANTS
-BACKEND_FISH_DF = ac_tls.get_backend_fish_df()
-ENDUSER_FISH_DF = ac_tls.filter_backend_table(BACKEND_FISH_DF)
-AVAIL_FISH = BACKEND_FISH_DF[BACKEND_FISH_DF.columns[0]].unique()
-AVAIL_MONTHS = BACKEND_FISH_DF.loc[:, "January":"December"].columns.unique().tolist()
+# The fish data lives in serving.current(), refreshed in the background
+# every ACNH_REFRESH_INTERVAL seconds if that is set
+serving.refresh()
+REFRESH_INTERVAL = float(os.environ.get("ACNH_REFRESH_INTERVAL", 0))
+if REFRESH_INTERVAL:
+    serving.RefreshScheduler(REFRESH_INTERVAL).start()
+
+# Server-side collection storage is optional, dcc.Store on the client is the default
+COLLECTION_DB = (
+    col_tls.CollectionDB(os.environ["ACNH_COLLECTION_DB"])
+    if os.environ.get("ACNH_COLLECTION_DB")
+    else None
+)
 #
 
-app.layout = html.Div(
-    [
-        # THIS IS EVERYTHING ABOVE THE DASH TABLE
-        html.Div(
-            children=[
-                # TITLE
-                html.H3(id="title", children="The Fish Database",),
-                # DESCRIPTION
-                html.Div(
-                    children=[
-                        """
-                        Welcome to the internet's premier fish database.
-                        Choose from the dropdowns below to explore.
-                        """
-                    ],
-                    style={"padding": "10px 5px"},
-                ),
-                # CONTAINER FOR fish-dropdown AND month-dropdown
-                html.Div(
-                    children=[
-                        # DROPDOWN FISH NAME
-                        html.Div(
-                            children=[
-                                "Filter by fish name",
-                                dcc.Dropdown(
-                                    id="fish-dropdown",
-                                    options=tls.iteratable_to_dropdown_options(
-                                        AVAIL_FISH
-                                    ),
-                                    placeholder="Choose fish...",
-                                    multi=True,
+
+def serve_layout():
+    """Builds the layout on every page load from the current data snapshot,
+    whose records and dropdown options are prepared once per refresh"""
+
+    snapshot = serving.current()
+
+    return html.Div(
+        [
+            # THIS IS EVERYTHING ABOVE THE DASH TABLE
+            html.Div(
+                children=[
+                    # TITLE
+                    html.H3(id="title", children="The Fish Database",),
+                    # DESCRIPTION
+                    html.Div(
+                        children=[
+                            """
+                            Welcome to the internet's premier fish database.
+                            Choose from the dropdowns below to explore.
+                            """
+                        ],
+                        style={"padding": "10px 5px"},
+                    ),
+                    # HEMISPHERE SELECTOR
+                    html.Div(
+                        children=[
+                            "Your island's hemisphere",
+                            dcc.RadioItems(
+                                id="hemisphere-radio",
+                                options=tls.iteratable_to_dropdown_options(
+                                    ac_tls.HEMISPHERES
                                 ),
-                            ],
-                            style={"width": "49%", "display": "inline-block"},
-                        ),
-                        # DROPDOWN ACTIVE MONTH
-                        html.Div(
-                            children=[
-                                "Filter by month fish is active",
-                                dcc.Dropdown(
-                                    id="month-dropdown",
-                                    options=tls.iteratable_to_dropdown_options(
-                                        ["All"] + AVAIL_MONTHS  # Make 'all' an option!
+                                value="Northern",
+                                labelStyle={"display": "inline-block"},
+                            ),
+                        ],
+                        style={"padding": "0px 5px 10px"},
+                    ),
+                    # CONTAINER FOR fish-dropdown AND month-dropdown
+                    html.Div(
+                        children=[
+                            # DROPDOWN FISH NAME
+                            html.Div(
+                                children=[
+                                    "Filter by fish name",
+                                    dcc.Dropdown(
+                                        id="fish-dropdown",
+                                        options=snapshot.fish_options,
+                                        placeholder="Choose fish...",
+                                        multi=True,
                                     ),
-                                    placeholder="Choose month(s)...",
-                                    multi=True,
-                                ),
-                            ],
-                            style={
-                                "width": "49%",
-                                "float": "right",
-                                "display": "inline-block",
-                            },
-                        ),
-                    ]
-                ),
-                # CONTAINER FOR month-leaving-dropdown AND month-arriving-dropdown
-                html.Div(
-                    children=[
-                        # DROPDOWN LEAVING FISH
-                        html.Div(
-                            children=[
-                                "Find fish leaving your island",
-                                dcc.Dropdown(
-                                    id="month-leaving-dropdown",
-                                    options=tls.dict_to_dropdown_options(
-                                        dict(
-                                            zip(
-                                                list(
-                                                    "Leaving after {}".format(month)
-                                                    for month in AVAIL_MONTHS
-                                                ),
-                                                AVAIL_MONTHS,
-                                            )
-                                        )
+                                ],
+                                style={"width": "49%", "display": "inline-block"},
+                            ),
+                            # DROPDOWN ACTIVE MONTH
+                            html.Div(
+                                children=[
+                                    "Filter by month fish is active",
+                                    dcc.Dropdown(
+                                        id="month-dropdown",
+                                        options=snapshot.month_options,
+                                        placeholder="Choose month(s)...",
+                                        multi=True,
                                     ),
-                                    placeholder="Choose month...",
-                                    multi=False,
-                                    disabled=False,
-                                ),
-                            ],
-                            style={"width": "49%", "display": "inline-block"},
-                        ),
-                        # DROPDOWN ARRIVING FISH
-                        html.Div(
-                            children=[
-                                "Find fish coming to your island",
-                                dcc.Dropdown(
-                                    id="month-arriving-dropdown",
-                                    options=tls.dict_to_dropdown_options(
-                                        dict(
-                                            zip(
-                                                list(
-                                                    "Arriving in {}".format(month)
-                                                    for month in AVAIL_MONTHS
-                                                ),
-                                                AVAIL_MONTHS,
-                                            )
-                                        )
+                                ],
+                                style={
+                                    "width": "49%",
+                                    "float": "right",
+                                    "display": "inline-block",
+                                },
+                            ),
+                        ]
+                    ),
+                    # CONTAINER FOR month-leaving-dropdown AND month-arriving-dropdown
+                    html.Div(
+                        children=[
+                            # DROPDOWN LEAVING FISH
+                            html.Div(
+                                children=[
+                                    "Find fish leaving your island",
+                                    dcc.Dropdown(
+                                        id="month-leaving-dropdown",
+                                        options=snapshot.leaving_options,
+                                        placeholder="Choose month...",
+                                        multi=False,
+                                        disabled=False,
                                     ),
-                                    placeholder="Choose month...",
-                                    multi=False,
-                                    disabled=False,
-                                ),
-                            ],
-                            style={
-                                "width": "49%",
-                                "float": "right",
-                                "display": "inline-block",
-                            },
-                        ),
-                    ],
-                    style={"padding": "10px 0px"},
-                ),
-            ],
-            style={
-                "borderBottom": "thin lightgrey solid",
-                "backgroundColor": "rgb(250, 250, 250)",
-                "padding": "10px 5px",
-            },
-        ),
-        # THIS IS THE DASH TABLE
-        html.Div(
-            children=dash_table.DataTable(
-                id="fish-df",
-                columns=tls.df_cols_to_dashtable_cols(ENDUSER_FISH_DF),
-                data=ENDUSER_FISH_DF.to_dict("records"),
-                style_as_list_view=True,  # Remove vertical lines
-                style_header={"textAlign": "left", "fontWeight": "bold"},
-                style_data_conditional=[  # Make striped rows for easy viewing
-                    {
-                        "if": {"row_index": "odd"},
-                        "backgroundColor": "rgb(248, 248, 248)",
-                    }
-                ],
-                style_data={"font": "Arial"},  # Love me some Arial
-                sort_action="native",  # Allow user to sort
-            ),
-            style={
-                "marginBottom": 50,
-                "marginTop": 25,
-                "marginRight": 25,
-                "marginLeft": 25,
-            },
-        ),
-        # THIS IS A FOOTER
-        html.Div(
-            children=html.Footer(
-                id="footer",
-                children=[
-                    "Come see this project on ",
-                    html.A("GitHub", href="https://www.github.com/granthussey"),
-                    ". Code by Grant Hussey. Visit my website: ",
-                    html.A("www.granthussey.com", href="https://www.granthussey.com"),
-                    html.Br(),
-                    "Original dataset taken from ",
-                    html.A(
-                        "this Google Sheet.",
-                        href="https://docs.google.com/spreadsheets/d/1ooePgv7AmENQsoxPuvChIa3S4CnZlUgwMLHXTjKXf-4/htmlview",
+                                ],
+                                style={"width": "49%", "display": "inline-block"},
+                            ),
+                            # DROPDOWN ARRIVING FISH
+                            html.Div(
+                                children=[
+                                    "Find fish coming to your island",
+                                    dcc.Dropdown(
+                                        id="month-arriving-dropdown",
+                                        options=snapshot.arriving_options,
+                                        placeholder="Choose month...",
+                                        multi=False,
+                                        disabled=False,
+                                    ),
+                                ],
+                                style={
+                                    "width": "49%",
+                                    "float": "right",
+                                    "display": "inline-block",
+                                },
+                            ),
+                        ],
+                        style={"padding": "10px 0px"},
+                    ),
+                    # CONTAINER FOR THE USER'S COLLECTION
+                    html.Div(
+                        children=[
+                            # DROPDOWN FISH TO MARK
+                            html.Div(
+                                children=[
+                                    "Track the fish on your island",
+                                    dcc.Dropdown(
+                                        id="collection-dropdown",
+                                        options=snapshot.fish_options,
+                                        placeholder="Choose fish to mark...",
+                                        multi=True,
+                                    ),
+                                    html.Button("Caught", id="mark-caught-button"),
+                                    html.Button("Donated", id="mark-donated-button"),
+                                    html.Button("Unmark", id="unmark-button"),
+                                ],
+                                style={"width": "49%", "display": "inline-block"},
+                            ),
+                            # MISSING-ONLY TOGGLE AND COLLECTION SUMMARY
+                            html.Div(
+                                children=[
+                                    dcc.Checklist(
+                                        id="missing-only-checklist",
+                                        options=[
+                                            {
+                                                "label": "Only show fish I haven't caught",
+                                                "value": "missing",
+                                            }
+                                        ],
+                                        value=[],
+                                    ),
+                                    html.Div(id="collection-summary"),
+                                ],
+                                style={
+                                    "width": "49%",
+                                    "float": "right",
+                                    "display": "inline-block",
+                                },
+                            ),
+                            # ISLAND ID, TO RESTORE A COLLECTION FROM THE SERVER
+                            html.Div(
+                                children=[
+                                    dcc.Input(
+                                        id="island-id-input",
+                                        placeholder="Enter your island id...",
+                                        type="text",
+                                    ),
+                                    html.Button(
+                                        "Restore", id="load-collection-button"
+                                    ),
+                                ],
+                                # only useful with server-side storage
+                                style={
+                                    "display": "block" if COLLECTION_DB else "none"
+                                },
+                            ),
+                            # THE USER'S CAUGHT/DONATED BITSETS, KEPT IN THE BROWSER
+                            dcc.Store(id="collection-store", storage_type="local"),
+                        ],
+                        style={"padding": "10px 0px"},
                     ),
                 ],
                 style={
-                    "justify": "center",
-                    "background-color": "#D3D3D3",
-                    "padding": "5px",
+                    "borderBottom": "thin lightgrey solid",
+                    "backgroundColor": "rgb(250, 250, 250)",
+                    "padding": "10px 5px",
                 },
             ),
-            style={"text-align": "center"},
-        ),
-    ]
-)
+            # THIS IS THE DASH TABLE
+            html.Div(
+                children=dash_table.DataTable(
+                    id="fish-df",
+                    columns=snapshot.columns,
+                    data=snapshot.records,
+                    style_as_list_view=True,  # Remove vertical lines
+                    style_header={"textAlign": "left", "fontWeight": "bold"},
+                    style_data_conditional=[  # Make striped rows for easy viewing
+                        {
+                            "if": {"row_index": "odd"},
+                            "backgroundColor": "rgb(248, 248, 248)",
+                        }
+                    ],
+                    style_data={"font": "Arial"},  # Love me some Arial
+                    sort_action="native",  # Allow user to sort
+                ),
+                style={
+                    "marginBottom": 50,
+                    "marginTop": 25,
+                    "marginRight": 25,
+                    "marginLeft": 25,
+                },
+            ),
+            # THIS IS A FOOTER
+            html.Div(
+                children=html.Footer(
+                    id="footer",
+                    children=[
+                        "Come see this project on ",
+                        html.A("GitHub", href="https://www.github.com/granthussey"),
+                        ". Code by Grant Hussey. Visit my website: ",
+                        html.A("www.granthussey.com", href="https://www.granthussey.com"),
+                        html.Br(),
+                        "Original dataset taken from ",
+                        html.A(
+                            "this Google Sheet.",
+                            href="https://docs.google.com/spreadsheets/d/1ooePgv7AmENQsoxPuvChIa3S4CnZlUgwMLHXTjKXf-4/htmlview",
+                        ),
+                    ],
+                    style={
+                        "justify": "center",
+                        "background-color": "#D3D3D3",
+                        "padding": "5px",
+                    },
+                ),
+                style={"text-align": "center"},
+            ),
+        ]
+    )
+
+
+app.layout = serve_layout
+
+
+def get_cached_logic(snapshot, kind, months, hemisphere):
+    """Caches the month-based logical vectors in the snapshot, keyed by hemisphere.
+    A refresh publishes a new snapshot with an empty cache, so nothing goes stale.
+    Only month/hemisphere inputs are keys, so the cache stays small.
+    
+    Args:
+        snapshot (serving.DataSnapshot)
+        kind (str): "month", "arriving" or "leaving"
+        months (tuple): selected month(s), a tuple so it can be hashed
+        hemisphere (str): "Northern" or "Southern"
+    
+    Returns:
+        np.array: read-only logical vector
+    """
+
+    return serving.get_cached(
+        snapshot.logic_cache,
+        (kind, months, hemisphere),
+        lambda: compute_logic(snapshot, kind, months, hemisphere),
+    )
+
+
+def compute_logic(snapshot, kind, months, hemisphere):
+    """Uncached get_cached_logic"""
+
+    if kind == "arriving":
+        selected = ac_tls.get_species_arriving_logic(
+            months[0], snapshot.avail_months, snapshot.backend_df, hemisphere
+        )
+    elif kind == "leaving":
+        selected = ac_tls.get_species_leaving_logic(
+            months[0], snapshot.avail_months, snapshot.backend_df, hemisphere
+        )
+    else:
+        selected = ac_tls.get_month_logic(snapshot.backend_df, list(months), hemisphere)
+
+    selected = np.array(selected, dtype=bool)
+    selected.flags.writeable = False  # shared between callbacks
+    return selected
 
 
 @app.callback(
@@ -218,19 +336,21 @@ app.layout = html.Div(
         Input("fish-dropdown", "value"),
         Input("month-arriving-dropdown", "value"),
         Input("month-leaving-dropdown", "value"),
+        Input("missing-only-checklist", "value"),
+        Input("collection-store", "data"),
+        Input("hemisphere-radio", "value"),
     ],
 )
 def update_table(
-    month_dropdown_value, fish_dropdown_value, month_arriving_value, month_leaving_value
+    month_dropdown_value,
+    fish_dropdown_value,
+    month_arriving_value,
+    month_leaving_value,
+    missing_only_value,
+    collection,
+    hemisphere,
 ):
 
-    # print()
-    # print(month_dropdown_value)
-    # print(fish_dropdown_value)
-    # print(month_arriving_value)
-    # print(month_leaving_value)
-    # print()
-
     """
     Logical Overview
     1) Check to see if user selected options for "month-arriving-dropdown" or "month-leaving-dropdown"
@@ -238,53 +358,177 @@ def update_table(
     
     2) Otherwise, process "selected" vectors for month-dropdown and fish-dropdown
         a. OR those vectors together!
+
+    3) If "missing-only-checklist" is ticked, AND the result with ~caught
     """
 
-    # need to rethink loop lol
-    # but let's build these two fxns first
-    # then apply them, should be relatively easy.
+    snapshot = serving.current()
+    missing_only = bool(missing_only_value)
+    hemisphere = hemisphere or "Northern"
 
     if isinstance(month_arriving_value, str):
-        selected = ac_tls.get_species_arriving_logic(
-            month_arriving_value, AVAIL_MONTHS, BACKEND_FISH_DF
-        )
-        return (
-            ENDUSER_FISH_DF.loc[selected].to_dict("records"),
-            tls.df_cols_to_dashtable_cols(ENDUSER_FISH_DF.loc[selected]),
+        selected = get_cached_logic(
+            snapshot, "arriving", (month_arriving_value,), hemisphere
         )
 
     elif isinstance(month_leaving_value, str):
-        selected = ac_tls.get_species_leaving_logic(
-            month_leaving_value, AVAIL_MONTHS, BACKEND_FISH_DF
-        )
-        return (
-            ENDUSER_FISH_DF.loc[selected].to_dict("records"),
-            tls.df_cols_to_dashtable_cols(ENDUSER_FISH_DF.loc[selected]),
+        selected = get_cached_logic(
+            snapshot, "leaving", (month_leaving_value,), hemisphere
         )
 
+    # Nothing else chosen, so "missing only" means every fish not yet caught
+    elif not month_dropdown_value and not fish_dropdown_value and missing_only:
+        selected = [True] * len(snapshot.backend_df)
+
+    # Don't update if [] or None
+    elif not month_dropdown_value and not fish_dropdown_value:
+        raise PreventUpdate
+
     else:
 
-        # Don't update if [] or None
-        if not month_dropdown_value and not fish_dropdown_value:
+        # Get months filter if it exists
+        if isinstance(month_dropdown_value, str):
+            month_dropdown_value = [month_dropdown_value]
+        log1 = get_cached_logic(
+            snapshot, "month", tuple(sorted(month_dropdown_value or [])), hemisphere
+        )
+
+        # Get fish filter if that exists
+        log2 = ac_tls.get_fish_logic(snapshot.backend_df, fish_dropdown_value)
+
+        # or is not element-wise for lists, so use np
+        selected = np.logical_or(log1, log2)
+
+    if missing_only:
+        selected = col_tls.get_missing_logic(
+            selected, get_user_collection(collection, snapshot)
+        )
+
+    return serving.get_records(snapshot, selected), snapshot.columns
+
+
+def get_user_collection(collection, snapshot):
+    """Validates the collection from the store against the snapshot's fish.
+    If it's empty or malformed, restores it from COLLECTION_DB when possible,
+    otherwise starts a new one."""
+
+    creature_names = snapshot.creature_names
+
+    validated = col_tls.validate_collection(collection, creature_names)
+    if validated is not None:
+        return validated
+
+    user = collection.get("user") if isinstance(collection, dict) else None
+    if not isinstance(user, str):
+        user = None
+
+    if COLLECTION_DB is not None and user:
+        return COLLECTION_DB.load(user, creature_names)
+
+    return col_tls.new_collection(creature_names, user=user)
+
+
+# What each collection button changes
+COLLECTION_BUTTON_CHANGES = {
+    "mark-caught-button": [("caught", True)],
+    # you can't donate what you haven't caught
+    "mark-donated-button": [("caught", True), ("donated", True)],
+    "unmark-button": [("caught", False), ("donated", False)],
+}
+
+
+# Mark or unmark fish in the user's collection, or restore it by island id
+@app.callback(
+    Output("collection-store", "data"),
+    [
+        Input("mark-caught-button", "n_clicks"),
+        Input("mark-donated-button", "n_clicks"),
+        Input("unmark-button", "n_clicks"),
+        Input("load-collection-button", "n_clicks"),
+    ],
+    [
+        State("collection-dropdown", "value"),
+        State("island-id-input", "value"),
+        State("collection-store", "data"),
+    ],
+)
+def update_collection(
+    caught_clicks,
+    donated_clicks,
+    unmark_clicks,
+    load_clicks,
+    collection_dropdown_value,
+    island_id_value,
+    collection,
+):
+    """Flips the bits of the fish chosen in collection-dropdown,
+    or replaces the collection with the one saved on the server for island-id-input"""
+
+    ctx = dash.callback_context
+    if not ctx.triggered:
+        raise PreventUpdate
+
+    button_id = ctx.triggered[0]["prop_id"].split(".")[0]
+    snapshot = serving.current()
+
+    if button_id == "load-collection-button":
+        if COLLECTION_DB is None or not island_id_value:
             raise PreventUpdate
 
-        # Update otherwise
-        else:
+        return COLLECTION_DB.load(island_id_value.strip(), snapshot.creature_names)
 
-            # Get months filter if it exists
-            log1 = ac_tls.get_month_logic(BACKEND_FISH_DF, month_dropdown_value)
+    # Don't update on page load or if no fish are chosen
+    if button_id not in COLLECTION_BUTTON_CHANGES or not collection_dropdown_value:
+        raise PreventUpdate
 
-            # Get fish filter if that exists
-            log2 = ac_tls.get_fish_logic(BACKEND_FISH_DF, fish_dropdown_value)
+    if isinstance(collection_dropdown_value, str):
+        collection_dropdown_value = [collection_dropdown_value]
 
-            # or is not element-wise for lists, so use np
-            selected = np.logical_or(log1, log2)
+    # A collection from a worker on newer data can't be remapped here yet.
+    # Without the server copy to restore from, leave it alone rather than reset it.
+    col_tls.register_names(snapshot.creature_names)
+    if (
+        COLLECTION_DB is None
+        and isinstance(collection, dict)
+        and isinstance(collection.get("key"), str)
+        and not col_tls.is_known_collection(collection)
+    ):
+        print("there was an unknown collection key in update_collection")
+        raise PreventUpdate
 
-            return (
-                ENDUSER_FISH_DF.loc[selected].to_dict("records"),
-                tls.df_cols_to_dashtable_cols(ENDUSER_FISH_DF.loc[selected]),
+    collection = get_user_collection(collection, snapshot)
+    for kind, value in COLLECTION_BUTTON_CHANGES[button_id]:
+        collection = col_tls.update_collection(
+            collection, kind, collection_dropdown_value, value
+        )
+        if COLLECTION_DB is not None:
+            COLLECTION_DB.record(
+                collection["user"], kind, collection_dropdown_value, value
             )
 
+    return collection
+
+
+@app.callback(
+    Output("collection-summary", "children"), [Input("collection-store", "data")]
+)
+def update_collection_summary(collection):
+    """Shows how many fish the user has caught and donated,
+    and their island id if collections are saved on the server"""
+
+    stored = collection
+    collection = get_user_collection(collection, serving.current())
+    caught = col_tls.get_collection_logic(collection, "caught").sum()
+    donated = col_tls.get_collection_logic(collection, "donated").sum()
+
+    summary = "Caught {} of {} fish, donated {}.".format(
+        caught, len(serving.current().creature_names), donated
+    )
+    # a new collection's random id isn't kept until the first fish is marked
+    if COLLECTION_DB is not None and stored:
+        summary += " Your island id is {}.".format(collection["user"])
+    return summary
+
 
 # Disable certain dropdowns when others are filled
 @app.callback(
@@ -327,5 +571,4 @@ def input_controls(
 
 if __name__ == "__main__":
     # app.run_server(debug=True)
-    server = app.server
-    # app.run_server(debug=True, dev_tools_hot_reload=False)
+    app.run_server(debug=True, dev_tools_hot_reload=False)
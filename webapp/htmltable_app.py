@@ -1,116 +1,217 @@
+import gzip
+import os
+import time
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
+import flask
+
+import personal_dash_tools as tls
+import ac_df_tools as ac_tls
+import serving
 
-import pandas as pd
-import numpy as np
+#
+# This is the low-JS version of the fish database.
+# Every page (each month, plus the unfiltered table) is rendered to plain HTML
+# once, gzipped, and kept in memory. /pages/<hemisphere>/<page> serves those
+# bytes directly, which suits low-end clients and crawlers. /pages/ links to
+# every page without any JavaScript. The Dash layout on / is just a thin
+# dropdown on top of the same pages, with a <noscript> link to /pages/.
+# The pages are rebuilt whenever serving refreshes the data, every
+# ACNH_REFRESH_INTERVAL seconds if that is set.
+#
 
 # Set stylesheet and initialize app
 external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+server = app.server
 
-# Read in fish and bugs csv
-# df = pd.read_csv('https://plotly.github.io/datasets/country_indicators.csv')
-
-fish = pd.read_pickle("/Users/granthussey/github/ACNL/data/acnl_fish.pkl")
-# bugs = pd.read_pickle('/Users/granthussey/github/ACNL/data/acnl_bug.pkl')
-
-available_fish = fish[fish.columns[0]].unique()
-# available_bugs =
-available_months = fish.loc[:, "All":"December"].columns.unique()
-
-
-def generate_table(dataframe, max_rows=100):
-    return html.Table(
-        children=[
-            html.Thead(html.Tr([html.Th(col) for col in dataframe.columns])),
-            html.Tbody(
-                [
-                    html.Tr(
-                        [html.Td(dataframe.iloc[i][col]) for col in dataframe.columns]
-                    )
-                    for i in range(min(len(dataframe), max_rows))
-                ]
-            ),
-        ]
-    )
+# Dash's default index page, plus a link for clients without JavaScript
+app.index_string = """<!DOCTYPE html>
+<html>
+    <head>
+        {%metas%}
+        <title>{%title%}</title>
+        {%favicon%}
+        {%css%}
+    </head>
+    <body>
+        <noscript>
+            <a href="/pages/">Browse the fish database without JavaScript</a>
+        </noscript>
+        {%app_entry%}
+        <footer>
+            {%config%}
+            {%scripts%}
+            {%renderer%}
+        </footer>
+    </body>
+</html>
+"""
 
+#
+# CONSTANTS
+ALL_PAGE = "All"
+PAGES = [ALL_PAGE] + ac_tls.MONTHS
+#
 
-def filter_backend_table(backend_table):
+# {(hemisphere, page): {"body": gzipped html bytes, "render_ms": float}}
+# Replaced wholesale by refresh_page_cache, never mutated in place
+PAGE_CACHE = {}
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<link rel="stylesheet" href="{stylesheet}">
+</head>
+<body>
+<h3>{title}</h3>
+<nav>{nav}</nav>
+{table}
+</body>
+</html>
+"""
+
+
+INDEX_URL = "/pages/"
 
-    if backend_table.columns[0] == "Bug":
-        df = backend_table.filter(
-            items=[
-                backend_table.columns[0],
-                "Location",
-                "Price",
-                "Active start hours",
-                "Active end hour",
-            ]
-        )
 
-    elif backend_table.columns[0] == "Fish":
-        df = backend_table.filter(
-            items=[
-                backend_table.columns[0],
-                "Location",
-                "Shadow size",
-                "Price",
-                "Active start hours",
-                "Active end hour",
-            ]
+def get_page_url(hemisphere, page):
+    return "/pages/{}/{}".format(hemisphere, page)
+
+
+def get_page_link(hemisphere, page, label=None):
+    return '<a href="{}">{}</a>'.format(get_page_url(hemisphere, page), label or page)
+
+
+def render_index():
+    """Renders the plain html index linking every (hemisphere, page)"""
+
+    sections = "\n".join(
+        "<h4>{} Hemisphere</h4>\n<p>{}</p>".format(
+            hemisphere,
+            " | ".join(get_page_link(hemisphere, page) for page in PAGES),
         )
+        for hemisphere in ac_tls.HEMISPHERES
+    )
 
-    return df
+    return PAGE_TEMPLATE.format(
+        title="The Fish Database",
+        stylesheet=external_stylesheets[0],
+        nav="",
+        table=sections,
+    )
 
 
-def filter_given_months(backend_table, months):
+def render_page(backend_df, hemisphere, page):
+    """Renders one page of the fish table to a full html document
 
-    """
-    This needs to take either a list or a str and deal with it properly.
+    Args:
+        backend_df (dataframe)
+        hemisphere (str): "Northern" or "Southern"
+        page (str): a month, or ALL_PAGE for the unfiltered table
+
+    Returns:
+        str: html
     """
 
-    # remove columns from backend_table that we wont want to show
-    presentable_df = filter_backend_table(backend_table)
+    if page == ALL_PAGE:
+        selected = [True] * len(backend_df)
+        title = "The Fish Database ({} Hemisphere)".format(hemisphere)
+    else:
+        selected = ac_tls.get_month_logic(backend_df, page, hemisphere)
+        title = "Fish active in {} ({} Hemisphere)".format(page, hemisphere)
 
-    # print('This is the length of presentable_df ' + str(len(presentable_df)))
+    # every page in this hemisphere, then this page in every hemisphere
+    nav = "{}<br>{}<br>{}".format(
+        " | ".join(get_page_link(hemisphere, each) for each in PAGES),
+        " | ".join(
+            get_page_link(each, page, "{} Hemisphere".format(each))
+            for each in ac_tls.HEMISPHERES
+        ),
+        '<a href="{}">All pages</a>'.format(INDEX_URL),
+    )
 
-    try:
+    table = ac_tls.filter_backend_table(backend_df).loc[selected]
 
-        # If user inputs a single month
-        if isinstance(months, str):
-            selected = backend_table[months]
-            # print('This is the length of filtered df is  ' + str(len(presentable_df.loc[selected])))
-            # print()
-            # print()
-            # print()
+    return PAGE_TEMPLATE.format(
+        title=title,
+        stylesheet=external_stylesheets[0],
+        nav=nav,
+        table=table.to_html(index=False, border=0),
+    )
+
+
+def build_page_cache(backend_df):
+    """Renders and gzips every (hemisphere, page), timing each one"""
+
+    cache = {}
+    for hemisphere in ac_tls.HEMISPHERES:
+        for page in PAGES:
+            start = time.perf_counter()
+            body = gzip.compress(render_page(backend_df, hemisphere, page).encode())
+            render_ms = (time.perf_counter() - start) * 1000
+
+            cache[(hemisphere, page)] = {"body": body, "render_ms": render_ms}
+
+    return cache
+
+
+# The index doesn't depend on the data, so it's rendered once
+INDEX_PAGE = gzip.compress(render_index().encode())
+
+
+def refresh_page_cache(snapshot):
+    """Swaps in a page cache rendered from a freshly published data snapshot"""
+
+    global PAGE_CACHE
+    PAGE_CACHE = build_page_cache(snapshot.backend_df)
 
-            # Return proper df
-            return generate_table(presentable_df.loc[selected])
 
-        # If user inputs more than one month
-        elif isinstance(months, list):
-            # initialize an all-true vector to use later
-            selected = pd.Series([True] * len(presentable_df))
-            for each_month in months:
-                selected = selected & backend_table[each_month]
+def make_page_response(body):
+    """Responds with gzipped html body, decompressed if the client refuses gzip"""
 
-            # print('This is the length of filtered df is  ' + str(len(presentable_df.loc[selected])))
-            # print()
-            # print()
-            # print()
-            # Return proper df
-            return generate_table(presentable_df.loc[selected])
+    # accept_encodings honours quality values, so "gzip;q=0" means no
+    if flask.request.accept_encodings["gzip"]:
+        response = flask.make_response(body)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = flask.make_response(gzip.decompress(body))
 
-        # If empty string (user deleted everything from Dropdown)
-        elif not months:
-            pass
+    response.headers["Content-Type"] = "text/html; charset=utf-8"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
 
-    except Exception:
-        print("There was an exception in filter_given_months() function")
-        pass
 
+@server.route(INDEX_URL)
+def serve_index():
+    return make_page_response(INDEX_PAGE)
+
+
+@server.route("/pages/<hemisphere>/<page>")
+def serve_page(hemisphere, page):
+    """Serves a pre-rendered page, reporting how long it took to render"""
+
+    cached = PAGE_CACHE.get((hemisphere, page))
+    if cached is None:
+        flask.abort(404)
+
+    response = make_page_response(cached["body"])
+    response.headers["Server-Timing"] = "render;dur={:.1f}".format(
+        cached["render_ms"]
+    )
+    return response
+
+
+serving.add_refresh_listener(refresh_page_cache)
+serving.refresh()
+REFRESH_INTERVAL = float(os.environ.get("ACNH_REFRESH_INTERVAL", 0))
+if REFRESH_INTERVAL:
+    serving.RefreshScheduler(REFRESH_INTERVAL).start()
 
 app.layout = html.Div(
     [
@@ -119,11 +220,13 @@ app.layout = html.Div(
             [
                 html.Div(
                     [
-                        dcc.Dropdown(
-                            id="fish",
-                            options=[{"label": i, "value": i} for i in available_fish],
-                            placeholder="Select a fish, or filter by month",
-                            multi=True,
+                        dcc.RadioItems(
+                            id="hemisphere",
+                            options=tls.iteratable_to_dropdown_options(
+                                ac_tls.HEMISPHERES
+                            ),
+                            value="Northern",
+                            labelStyle={"display": "inline-block"},
                         )
                     ],
                     style={"width": "49%", "display": "inline-block"},
@@ -132,11 +235,9 @@ app.layout = html.Div(
                     [
                         dcc.Dropdown(
                             id="month",
-                            options=[
-                                {"label": i, "value": i} for i in available_months
-                            ],
-                            value="March",
-                            multi=True,
+                            options=tls.iteratable_to_dropdown_options(PAGES),
+                            value=ALL_PAGE,
+                            clearable=False,
                         ),
                     ],
                     style={"width": "49%", "float": "right", "display": "inline-block"},
@@ -148,16 +249,21 @@ app.layout = html.Div(
                 "padding": "10px 5px",
             },
         ),
-        # Initialize the table for display
-        html.Div(id="my-table", children=generate_table(fish), style={"width": "80%"}),
+        # The pre-rendered page for display
+        html.Iframe(
+            id="my-table",
+            src=get_page_url("Northern", ALL_PAGE),
+            style={"width": "80%", "height": "80vh", "border": "none"},
+        ),
     ]
 )
 
 #
-@app.callback(Output("my-table", "children"), [Input("month", "value")])
-def update_table(months_to_filter):
-    # print(months_to_filter)
-    return filter_given_months(fish, months_to_filter)
+@app.callback(
+    Output("my-table", "src"), [Input("hemisphere", "value"), Input("month", "value")]
+)
+def update_table(hemisphere, month):
+    return get_page_url(hemisphere, month or ALL_PAGE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,409 @@
+"""Load test for dashtable_app.
+
+Launches dashtable_app:server (or asgi:application, for the "uvicorn" worker
+class) under gunicorn for each worker configuration, replays realistic
+_dash-update-component traffic against it with an asyncio client, and reports
+throughput, latency percentiles and per-worker RSS.
+
+The app reads its data from a local csv (ACNH_FISH_CSV) so runs are repeatable
+and don't hit the Google Sheet. Save one first, while online:
+
+    python loadtest.py --snapshot data/fish.csv
+
+Then, e.g.:
+
+    python loadtest.py --data-csv data/fish.csv --users 50 --duration 30 \\
+        --configs sync:4:1,gthread:2:8,gevent:4:1,uvicorn:2:8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+
+import numpy as np
+
+import ac_df_tools as ac_tls
+
+# worker_class:workers:threads
+DEFAULT_CONFIGS = "sync:1:1,sync:4:1,gthread:2:4,gthread:4:4"
+
+# Worker classes that serve the ASGI app, where threads is its request pool size
+ASGI_WORKER_CLASSES = {"uvicorn": "uvicorn.workers.UvicornWorker"}
+
+UPDATE_TABLE_INPUTS = [
+    ("month-dropdown", "value"),
+    ("fish-dropdown", "value"),
+    ("month-arriving-dropdown", "value"),
+    ("month-leaving-dropdown", "value"),
+    ("missing-only-checklist", "value"),
+    ("collection-store", "data"),
+    ("hemisphere-radio", "value"),
+]
+
+INPUT_CONTROLS_OUTPUTS = [
+    ("month-dropdown", "disabled"),
+    ("fish-dropdown", "disabled"),
+    ("month-dropdown", "value"),
+    ("fish-dropdown", "value"),
+    ("month-arriving-dropdown", "disabled"),
+    ("month-leaving-dropdown", "disabled"),
+]
+
+
+def dash_payload(outputs, inputs, changed):
+    """Builds a _dash-update-component request body
+
+    Args:
+        outputs (list): (id, property) pairs of the callback's outputs
+        inputs (list): (id, property, value) triples of the callback's inputs
+        changed (list): "id.property" strings that triggered the callback
+
+    Returns:
+        dict
+    """
+
+    return {
+        "output": "..{}..".format(
+            "...".join("{}.{}".format(*each) for each in outputs)
+        ),
+        "outputs": [{"id": i, "property": p} for i, p in outputs],
+        "inputs": [{"id": i, "property": p, "value": v} for i, p, v in inputs],
+        "changedPropIds": changed,
+        "state": [],
+    }
+
+
+def update_table_payload(state, changed):
+    """state maps an update_table input id to its current value"""
+
+    return dash_payload(
+        [("fish-df", "data"), ("fish-df", "columns")],
+        [(i, p, state.get(i)) for i, p in UPDATE_TABLE_INPUTS],
+        changed,
+    )
+
+
+def input_controls_payload(arriving, leaving, changed):
+    return dash_payload(
+        INPUT_CONTROLS_OUTPUTS,
+        [
+            ("month-arriving-dropdown", "value", arriving),
+            ("month-leaving-dropdown", "value", leaving),
+        ],
+        changed,
+    )
+
+
+def user_session(rng, fish, months):
+    """Yields the request bodies one simulated visitor sends, in order.
+
+    Mirrors what the browser does: picking an arriving/leaving month fires
+    input_controls and then update_table, anything else fires update_table.
+    """
+
+    state = {"hemisphere-radio": rng.choice(ac_tls.HEMISPHERES)}
+
+    for _ in range(rng.randint(3, 10)):
+        action = rng.choices(
+            ["months", "fish", "arriving", "leaving", "missing", "hemisphere"],
+            weights=[35, 25, 15, 10, 10, 5],
+        )[0]
+
+        if action == "months":
+            state["month-dropdown"] = rng.sample(months, rng.randint(1, 3))
+            changed = "month-dropdown.value"
+
+        elif action == "fish":
+            state["fish-dropdown"] = rng.sample(fish, rng.randint(1, 5))
+            changed = "fish-dropdown.value"
+
+        elif action in ("arriving", "leaving"):
+            key = "month-{}-dropdown".format(action)
+            state[key] = rng.choice(months)
+            yield input_controls_payload(
+                state.get("month-arriving-dropdown"),
+                state.get("month-leaving-dropdown"),
+                ["{}.value".format(key)],
+            )
+            state["month-dropdown"], state["fish-dropdown"] = [], []
+            changed = "{}.value".format(key)
+
+        elif action == "missing":
+            state["missing-only-checklist"] = ["missing"]
+            changed = "missing-only-checklist.value"
+
+        else:
+            state["hemisphere-radio"] = rng.choice(ac_tls.HEMISPHERES)
+            changed = "hemisphere-radio.value"
+
+        yield update_table_payload(state, [changed])
+
+        # clear arriving/leaving again so the next action isn't shadowed by it
+        for key in ("month-arriving-dropdown", "month-leaving-dropdown"):
+            if state.get(key):
+                state[key] = None
+                yield input_controls_payload(None, None, ["{}.value".format(key)])
+
+
+async def post_json(host, port, path, body):
+    """Sends one HTTP/1.1 POST and returns the status code"""
+
+    data = json.dumps(body).encode()
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(
+            (
+                "POST {} HTTP/1.1\r\n"
+                "Host: {}:{}\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: {}\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            .format(path, host, port, len(data))
+            .encode()
+            + data
+        )
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+
+    return int(response.split(b" ", 2)[1])
+
+
+def is_success(status):
+    """Dash answers PreventUpdate with 204, so any 2xx counts"""
+
+    return isinstance(status, int) and 200 <= status < 300
+
+
+async def virtual_user(rng, host, port, fish, months, deadline, timeout, results):
+    while time.monotonic() < deadline:
+        for body in user_session(rng, fish, months):
+            if time.monotonic() >= deadline:
+                return
+
+            start = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(
+                    post_json(host, port, "/_dash-update-component", body), timeout
+                )
+            except asyncio.TimeoutError:
+                status = "timeout"
+            except (OSError, IndexError, ValueError):
+                status = None  # refused, reset or garbled response
+            results.append((time.perf_counter() - start, status))
+
+            # think time between clicks
+            await asyncio.sleep(rng.uniform(0.1, 1.0))
+
+
+def get_layout_options(host, port):
+    """Reads the fish and month dropdown options from the running app's layout"""
+
+    url = "http://{}:{}/_dash-layout".format(host, port)
+    with urllib.request.urlopen(url) as response:
+        layout = json.load(response)
+
+    options = {}
+
+    def walk(node):
+        if isinstance(node, dict):
+            props = node.get("props", {})
+            if props.get("id") in ("fish-dropdown", "month-arriving-dropdown"):
+                options[props["id"]] = [each["value"] for each in props["options"]]
+            for value in props.values():
+                walk(value)
+        elif isinstance(node, list):
+            for each in node:
+                walk(each)
+
+    walk(layout)
+    return options["fish-dropdown"], options["month-arriving-dropdown"]
+
+
+def get_worker_rss(master_pid):
+    """Returns {pid: RSS in MB} for every gunicorn worker of master_pid (Linux)"""
+
+    rss = {}
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open("/proc/{}/status".format(pid)) as f:
+                status = dict(
+                    line.split(":", 1) for line in f.read().splitlines() if ":" in line
+                )
+        except OSError:
+            continue
+
+        if int(status["PPid"]) == master_pid and "VmRSS" in status:
+            rss[int(pid)] = int(status["VmRSS"].split()[0]) / 1024
+    return rss
+
+
+def wait_until_ready(host, port, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen("http://{}:{}/_dash-layout".format(host, port))
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError("app did not start within {} seconds".format(timeout))
+
+
+def run_config(worker_class, workers, threads, args):
+    """Runs one load test against a fresh gunicorn and returns a result row"""
+
+    env = dict(os.environ, ACNH_FISH_CSV=os.path.abspath(args.data_csv))
+
+    if worker_class in ASGI_WORKER_CLASSES:
+        env["ACNH_ASGI_THREADS"] = str(threads)
+        gunicorn_worker_class = ASGI_WORKER_CLASSES[worker_class]
+        app_target = "asgi:application"
+    else:
+        gunicorn_worker_class = worker_class
+        app_target = "dashtable_app:server"
+
+    gunicorn = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--worker-class",
+            gunicorn_worker_class,
+            "--workers",
+            str(workers),
+            "--threads",
+            str(threads),
+            "--bind",
+            "{}:{}".format(args.host, args.port),
+            app_target,
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        wait_until_ready(args.host, args.port)
+        fish, months = get_layout_options(args.host, args.port)
+
+        results = []
+        peak_rss = {}
+
+        async def main():
+            deadline = time.monotonic() + args.duration
+            users = [
+                virtual_user(
+                    random.Random(args.seed + i),
+                    args.host,
+                    args.port,
+                    fish,
+                    months,
+                    deadline,
+                    args.timeout,
+                    results,
+                )
+                for i in range(args.users)
+            ]
+            sampler = asyncio.ensure_future(sample_rss())
+            await asyncio.gather(*users)
+            sampler.cancel()
+
+        async def sample_rss():
+            while True:
+                for pid, mb in get_worker_rss(gunicorn.pid).items():
+                    peak_rss[pid] = max(mb, peak_rss.get(pid, 0))
+                await asyncio.sleep(1)
+
+        start = time.monotonic()
+        asyncio.run(main())
+        elapsed = time.monotonic() - start
+    finally:
+        gunicorn.terminate()
+        gunicorn.wait()
+
+    latencies = np.array([lat for lat, status in results if is_success(status)]) * 1000
+    errors = sum(not is_success(status) for _, status in results)
+    timeouts = sum(status == "timeout" for _, status in results)
+    p50, p90, p99 = (
+        np.percentile(latencies, [50, 90, 99]) if len(latencies) else (np.nan,) * 3
+    )
+
+    return {
+        "config": "{}:{}:{}".format(worker_class, workers, threads),
+        "requests": len(results),
+        "errors": errors,
+        "timeouts": timeouts,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": p50,
+        "p90_ms": p90,
+        "p99_ms": p99,
+        "max_ms": latencies.max() if len(latencies) else np.nan,
+        "rss_mb": sorted(round(mb, 1) for mb in peak_rss.values()),
+    }
+
+
+def print_report(rows):
+    columns = ["config", "requests", "errors", "timeouts", "req/s", "p50 ms"]
+    header = "{:<16} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}  {}".format(
+        *columns, "p90 ms", "p99 ms", "max ms", "peak RSS per worker (MB)"
+    )
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            "{config:<16} {requests:>8} {errors:>6} {timeouts:>8} {rps:>8.1f} "
+            "{p50_ms:>8.1f} {p90_ms:>8.1f} {p99_ms:>8.1f} {max_ms:>8.1f}  "
+            "{rss_mb}".format(**row)
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--snapshot", metavar="PATH", help="save the fish csv and exit")
+    parser.add_argument("--data-csv", help="csv saved with --snapshot")
+    parser.add_argument(
+        "--configs",
+        default=DEFAULT_CONFIGS,
+        help="comma separated worker_class:workers:threads (default %(default)s)",
+    )
+    parser.add_argument("--users", type=int, default=20, help="concurrent visitors")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per config")
+    parser.add_argument(
+        "--timeout", type=float, default=30, help="seconds before a request errors"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as json")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.snapshot:
+        urllib.request.urlretrieve(ac_tls.get_creature_data_url("fish"), args.snapshot)
+        sys.exit(0)
+
+    if not args.data_csv:
+        sys.exit("--data-csv is required (save one with --snapshot)")
+
+    rows = []
+    for config in args.configs.split(","):
+        worker_class, workers, threads = config.split(":")
+        print("running {} for {}s...".format(config, args.duration), file=sys.stderr)
+        rows.append(run_config(worker_class, int(workers), int(threads), args))
+
+    if args.json:
+        print(json.dumps(rows, default=float, indent=2))
+    else:
+        print_report(rows)
@@ -0,0 +1,269 @@
+"""Serving mode for dashtable_app with non-blocking data refresh.
+
+    python serving.py --mode threaded --threads 8 --refresh-interval 3600
+    python serving.py --mode asgi --threads 8 --refresh-interval 3600
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+
+The data the callbacks read lives in one immutable DataSnapshot. A background
+RefreshScheduler thread downloads and builds the next snapshot off the request
+path, then publishes it with a single reference swap (read-copy-update), so
+callbacks never take a lock on the data and never wait on the Google Sheet.
+"""
+
+import argparse
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+import personal_dash_tools as tls
+import ac_df_tools as ac_tls
+
+# Everything the callbacks read, built together and swapped in as one object.
+# Never mutate a published snapshot's dataframes, build and publish a new one.
+DataSnapshot = namedtuple(
+    "DataSnapshot",
+    [
+        "version",
+        "backend_df",
+        "enduser_df",
+        "avail_fish",
+        "avail_months",
+        "creature_names",  # first column in row order, for collections
+        "fish_options",
+        "month_options",
+        "arriving_options",
+        "leaving_options",
+        "columns",  # dash_table columns of enduser_df
+        "records",  # enduser_df.to_dict("records"), the unfiltered table
+        "logic_cache",  # LRUCache of logical vectors for this version only
+        "records_cache",  # LRUCache of serialized tables for this version only
+    ],
+)
+
+# How many logical vectors and serialized tables to keep per snapshot
+MAX_CACHED_LOGIC = 1024
+MAX_CACHED_RECORDS = 256
+
+_current = None
+_refresh_lock = threading.Lock()  # writers only, readers never touch it
+_refresh_listeners = []
+
+
+class LRUCache:
+    """A small thread-safe least-recently-used cache.
+
+    The lock only covers the dict operations, never computing a value.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value, or None on a miss"""
+
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+def get_cached(cache, key, compute):
+    """Returns cache's value for key, calling compute() and caching it on a miss.
+
+    compute runs outside the cache's lock, so two callbacks that miss on the
+    same key may both compute it. Either result is correct.
+    """
+
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.put(key, value)
+    return value
+
+
+def build_snapshot(backend_df, version=0):
+    """Builds a DataSnapshot from a freshly loaded backend dataframe"""
+
+    enduser_df = ac_tls.filter_backend_table(backend_df)
+    avail_fish = backend_df[backend_df.columns[0]].unique()
+    avail_months = backend_df.loc[:, "January":"December"].columns.unique().tolist()
+
+    return DataSnapshot(
+        version=version,
+        backend_df=backend_df,
+        enduser_df=enduser_df,
+        avail_fish=avail_fish,
+        avail_months=avail_months,
+        creature_names=backend_df[backend_df.columns[0]].tolist(),
+        fish_options=tls.iteratable_to_dropdown_options(avail_fish),
+        # Make 'all' an option!
+        month_options=tls.iteratable_to_dropdown_options(["All"] + avail_months),
+        arriving_options=tls.dict_to_dropdown_options(
+            {"Arriving in {}".format(month): month for month in avail_months}
+        ),
+        leaving_options=tls.dict_to_dropdown_options(
+            {"Leaving after {}".format(month): month for month in avail_months}
+        ),
+        columns=tls.df_cols_to_dashtable_cols(enduser_df),
+        records=enduser_df.to_dict("records"),
+        logic_cache=LRUCache(MAX_CACHED_LOGIC),
+        records_cache=LRUCache(MAX_CACHED_RECORDS),
+    )
+
+
+def current():
+    """Returns the published DataSnapshot. Read it once per callback and use
+    that reference throughout, so a refresh mid-callback can't mix versions."""
+
+    return _current
+
+
+def add_refresh_listener(listener):
+    """Calls listener(snapshot) after every refresh publishes a new snapshot,
+    on the refreshing thread, e.g. to rebuild something derived from the data"""
+
+    _refresh_listeners.append(listener)
+
+
+def refresh(loader=ac_tls.get_backend_fish_df):
+    """Loads new data, builds the next snapshot and publishes it atomically
+
+    Args:
+        loader (function, optional): returns a backend dataframe.
+        Defaults to ac_tls.get_backend_fish_df.
+
+    Returns:
+        DataSnapshot: the newly published snapshot
+    """
+
+    global _current
+
+    with _refresh_lock:
+        version = _current.version + 1 if _current is not None else 0
+        snapshot = build_snapshot(loader(), version=version)
+        _current = snapshot  # the swap, a single reference assignment
+
+        for listener in _refresh_listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                print("there was an error in a refresh listener: {}".format(e))
+
+    return snapshot
+
+
+def get_records(snapshot, selected):
+    """Returns snapshot.enduser_df.loc[selected].to_dict("records").
+
+    to_dict is the slow part of a callback, and users ask for the same few
+    tables over and over, so recently used selections are served from
+    records_cache. The cached lists are shared, so never mutate them.
+    """
+
+    selected = np.asarray(selected, dtype=bool)
+
+    return get_cached(
+        snapshot.records_cache,
+        np.packbits(selected).tobytes(),
+        lambda: snapshot.enduser_df.loc[selected].to_dict("records"),
+    )
+
+
+class RefreshScheduler(threading.Thread):
+    """Daemon thread that calls refresh() every interval seconds.
+
+    A failed refresh is printed and the current snapshot is kept.
+    """
+
+    def __init__(self, interval, loader=ac_tls.get_backend_fish_df):
+        super().__init__(name="data-refresh", daemon=True)
+        self.interval = interval
+        self.loader = loader
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                snapshot = refresh(self.loader)
+                print("data refreshed to version {}".format(snapshot.version))
+            except Exception as e:
+                print(
+                    "data refresh failed, still serving version {}: {}".format(
+                        _current.version, e
+                    )
+                )
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def make_asgi_app(server, workers=8):
+    """Wraps a Flask server for ASGI servers such as uvicorn.
+
+    Requests run on a pool of `workers` threads, so one slow callback only
+    ties up its own thread, not the event loop or the other requests.
+    """
+
+    try:
+        from a2wsgi import WSGIMiddleware
+    except ImportError:
+        raise ImportError("asgi mode needs a2wsgi: pip install a2wsgi uvicorn")
+
+    return WSGIMiddleware(server, workers=workers)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["threaded", "asgi"], default="threaded")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--threads", type=int, default=8, help="request threads")
+    parser.add_argument(
+        "--refresh-interval",
+        type=float,
+        default=0,
+        help="seconds between background data refreshes, 0 to never refresh",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # dashtable_app starts the RefreshScheduler itself when this is set
+    os.environ["ACNH_REFRESH_INTERVAL"] = str(args.refresh_interval)
+    from dashtable_app import server
+
+    if args.mode == "asgi":
+        import uvicorn
+
+        uvicorn.run(
+            make_asgi_app(server, workers=args.threads), host=args.host, port=args.port
+        )
+
+    else:
+        try:
+            import waitress
+        except ImportError:
+            waitress = None
+
+        if waitress is not None:
+            waitress.serve(server, host=args.host, port=args.port, threads=args.threads)
+        else:
+            # Flask's own server, fine for small deployments
+            server.run(host=args.host, port=args.port, threaded=True)